@@ -2,8 +2,9 @@
 # Copyright (c) 2012-2024 Snowflake Computing Inc. All rights reserved.
 #
 # The code in this file is largely a copy of https://github.com/Snowflake-Labs/snowcli/blob/main/src/snowcli/utils.py
-import glob
+import functools
 import hashlib
+import importlib.metadata
 import os
 import platform
 import re
@@ -11,13 +12,14 @@ import shutil
 import subprocess
 import sys
 import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from logging import getLogger
-from pathlib import Path
-from typing import AnyStr, Dict, List, Optional, Set, Tuple
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
 
-import pkg_resources
 import yaml
-from pkg_resources import Requirement
+from packaging.requirements import Requirement
 
 _logger = getLogger(__name__)
 PIP_ENVIRONMENT_VARIABLE: str = "PIP_NAME"
@@ -32,6 +34,30 @@ NATIVE_FILE_EXTENSIONS: Set[str] = {
     ".dylib",
     ".dll" if platform.system() == "Windows" else ".so",
 }
+# Files with these extensions are already compressed, so they are stored in the zip file without deflating them again
+COMPRESSED_FILE_EXTENSIONS: Set[str] = {
+    ".whl",
+    ".zip",
+    ".gz",
+    ".bz2",
+    ".xz",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+}
+_METADATA_NAME_PATTERN: re.Pattern = re.compile(rb"^Name: (.*?)\r?$", re.MULTILINE)
+_METADATA_VERSION_PATTERN: re.Pattern = re.compile(
+    rb"^Version: (.*?)\r?$", re.MULTILINE
+)
+# Chunk size used to copy files that are stored without compression into zip files
+_ZIP_WRITE_BUFFER_SIZE: int = 1 << 20
+# Files larger than this are streamed into zip files by zipfile instead of being compressed in memory on a thread pool
+_PARALLEL_DEFLATE_MAX_FILE_SIZE: int = 16 << 20
+# Upper bound on the total size of the files being compressed in memory at the same time
+_PARALLEL_DEFLATE_BUFFER_SIZE: int = 64 << 20
+# Name and Version headers are usually within the first few hundred bytes of a METADATA file
+_METADATA_HEADER_READ_SIZE: int = 4096
 
 
 def parse_requirements_text_file(file_path: str) -> Tuple[List[str], List[str]]:
@@ -144,19 +170,45 @@ def get_package_name_from_metadata(metadata_file_path: str) -> Optional[str]:
         None if package name cannot be found.
     """
 
-    with open(metadata_file_path, encoding="utf-8") as metadata_file:
-        contents: AnyStr = metadata_file.read()
-        regex_results = re.search("^Name: (.*)$", contents, flags=re.MULTILINE)
-        if regex_results is None:
-            return None
-        requirement_line: str = regex_results.group(1)
+    with open(metadata_file_path, "rb") as metadata_file:
+        contents: bytes = metadata_file.read(_METADATA_HEADER_READ_SIZE)
+        # Only search complete lines, unless the whole file has been read
+        header: bytes = (
+            contents[: contents.rfind(b"\n") + 1]
+            if len(contents) == _METADATA_HEADER_READ_SIZE
+            else contents
+        )
+        name_results = _METADATA_NAME_PATTERN.search(header)
+        version_results = _METADATA_VERSION_PATTERN.search(header)
+        if name_results is None or version_results is None:
+            # Fall back to searching the full file
+            contents += metadata_file.read()
+            name_results = _METADATA_NAME_PATTERN.search(contents)
+            version_results = _METADATA_VERSION_PATTERN.search(contents)
+
+    if name_results is None:
+        return None
+    requirement_line: str = name_results.group(1).decode("utf-8")
+    if version_results is not None:
+        version: str = version_results.group(1).decode("utf-8")
+        requirement_line += f"=={version}"
+
+    return requirement_line.strip().lower()
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_requirement(requirement: str) -> Requirement:
+    """
+    Parses a requirement string such as "numpy==1.24.3". The same installed packages are usually seen by many pip
+    installs in a process, so parsed requirements are cached and shared. Callers must not modify the returned object.
 
-        regex_results = re.search("^Version: (.*)$", contents, flags=re.MULTILINE)
-        if regex_results is not None:
-            version: str = regex_results.group(1)
-            requirement_line += f"=={version}"
+    Args:
+        requirement (str): The requirement string.
 
-        return requirement_line.strip().lower()
+    Returns:
+        Requirement: The parsed requirement.
+    """
+    return Requirement(requirement)
 
 
 def map_python_packages_to_files_and_folders(
@@ -184,51 +236,117 @@ def map_python_packages_to_files_and_folders(
     """
 
     package_name_to_record_entries_map: Dict[Requirement, List[str]] = {}
+    abs_directory: str = os.path.abspath(directory)
+    abs_directory_prefix: str = os.path.join(abs_directory, "")
+
+    # Record entries are either folders or files at the root folder. Collect the ones that exist with a single walk,
+    # so that record entries can be checked without a stat call each.
+    existing_entries: Set[str] = set()
+    for root, folders, files in os.walk(abs_directory):
+        relative_root = root[len(abs_directory_prefix) :].replace(os.sep, "/")
+        if relative_root:
+            existing_entries.update(f"{relative_root}/{folder}" for folder in folders)
+        else:
+            existing_entries.update(folders)
+            existing_entries.update(files)
+
+    with os.scandir(directory) as entries:
+        dist_info_folders: List[str] = [
+            entry.path
+            for entry in entries
+            if entry.name.endswith("dist-info") and entry.is_dir()
+        ]
+
+    def map_dist_info_folder(
+        parent_folder: str,
+    ) -> Optional[Tuple[Requirement, List[str]]]:
+        """
+        Reads the METADATA and RECORD files of a dist-info folder.
+
+        Args:
+            parent_folder (str): Path of the dist-info folder.
 
-    metadata_files: List[str] = glob.glob(
-        os.path.join(directory, "*dist-info", "METADATA")
-    )
-    for metadata_file in metadata_files:
-        parent_folder: str = os.path.dirname(metadata_file)
-        package: Optional[str] = get_package_name_from_metadata(metadata_file)
-
-        if package is not None:
-            # Determine which folders or files belong to this package
-            record_file_path = os.path.join(parent_folder, "RECORD")
-            if os.path.exists(record_file_path):
+        Returns:
+            Optional[Tuple[Requirement, List[str]]]: The package and the unique folder/file names that correspond to
+            it, or None if the METADATA or RECORD file is missing or malformed.
+        """
+        try:
+            package: Optional[str] = get_package_name_from_metadata(
+                os.path.join(parent_folder, "METADATA")
+            )
+        except FileNotFoundError:
+            return None
+        if package is None:
+            return None
+
+        # Determine which folders or files belong to this package
+        try:
+            with open(
+                os.path.join(parent_folder, "RECORD"), encoding="utf-8"
+            ) as record_file:
                 # Get unique root folder names
-                with open(record_file_path, encoding="utf-8") as record_file:
-                    record_entries = set()
-
-                    # Read in all record entries
-                    for line in record_file.readlines():
-                        entry = os.path.split(line)[0].split(",")[0]
-                        if entry == "":  # If true, a file present in the root folder
-                            entry = line.split(",")[0]
-                        record_entries.add(entry)
-
-                    # Only select unique base folders or files
-                    included_record_entries = []
-                    for record_entry in record_entries:
-                        record_entry_full_path = os.path.abspath(
-                            os.path.join(directory, record_entry),
-                        )
-                        # RECORD file might contain relative paths to items outside target folder. (ignore these)
-                        if (
-                            os.path.exists(record_entry_full_path)
-                            and directory in record_entry_full_path
-                            and len(record_entry) > 0
-                        ):
-                            included_record_entries.append(record_entry)
-
-                    # Create Requirement objects and store in map
-                    package_name_to_record_entries_map[
-                        Requirement.parse(package)
-                    ] = included_record_entries
+                record_entries = set()
+
+                # Read in all record entries
+                for line in record_file:
+                    # RECORD paths always use "/" as separator, so plain string searches are enough
+                    comma = line.find(",")
+                    path = line[:comma] if comma >= 0 else line
+                    slash = path.rfind("/")
+                    # If no slash is found, the entry is a file present in the root folder
+                    entry = path[:slash] if slash >= 0 else path
+                    record_entries.add(entry)
+        except FileNotFoundError:
+            return None
+
+        # Only select unique base folders or files
+        included_record_entries = []
+        for record_entry in record_entries:
+            record_entry_full_path = os.path.normpath(
+                os.path.join(abs_directory, record_entry),
+            )
+            normalized_record_entry = record_entry_full_path[
+                len(abs_directory_prefix) :
+            ].replace(os.sep, "/")
+            # RECORD file might contain relative paths to items outside target folder. (ignore these)
+            if (
+                len(record_entry) > 0
+                and record_entry_full_path.startswith(abs_directory_prefix)
+                and normalized_record_entry in existing_entries
+            ):
+                included_record_entries.append(record_entry)
+
+        return _parse_requirement(package), included_record_entries
+
+    # Reading dist-info folders is I/O bound, so they are processed on a thread pool and collected in order
+    with ThreadPoolExecutor(
+        max_workers=min(32, len(dist_info_folders) or 1)
+    ) as executor:
+        for result in executor.map(map_dist_info_folder, dist_info_folders):
+            if result is not None:
+                # Store Requirement objects in map
+                package_requirement, included_record_entries = result
+                package_name_to_record_entries_map[
+                    package_requirement
+                ] = included_record_entries
 
     return package_name_to_record_entries_map
 
 
+def get_requirement_version(requirement: Requirement) -> Optional[str]:
+    """
+    Returns the version pinned by a requirement such as "numpy==1.24.3".
+
+    Args:
+        requirement (Requirement): The package requirement.
+
+    Returns:
+        Optional[str]: The version of the first version specifier, or None if the requirement has no specifier.
+    """
+    specifier = next(iter(requirement.specifier), None)
+    return specifier.version if specifier is not None else None
+
+
 def identify_supported_packages(
     packages: List[Requirement],
     valid_packages: Dict[str, List[str]],
@@ -261,23 +379,24 @@ def identify_supported_packages(
     dropped_dependencies: List[Requirement] = []
     new_dependencies: List[Requirement] = []
     packages_to_be_uploaded: List[str] = []
+    valid_package_versions: Dict[str, Set[str]] = {
+        package_name: set(versions) for package_name, versions in valid_packages.items()
+    }
 
     for package in packages:
         package_name: str = package.name
-        package_version_required: Optional[str] = (
-            package.specs[0][1] if package.specs else None
-        )
+        package_version_required: Optional[str] = get_requirement_version(package)
         version_text = (
             f"(version {package_version_required})"
             if package_version_required is not None
             else ""
         )
 
-        if package_name in valid_packages:
+        if package_name in valid_package_versions:
             # Detect supported packages
             if (
                 package_version_required is None
-                or package_version_required in valid_packages[package_name]
+                or package_version_required in valid_package_versions[package_name]
             ):
                 supported_dependencies.append(package)
                 _logger.info(
@@ -291,13 +410,12 @@ def identify_supported_packages(
                         f"Package {package_name}{version_text} contains native code, switching to latest available version "
                         f"in Snowflake instead."
                     )
-                    new_dependencies.append(Requirement.parse(package_name))
+                    new_dependencies.append(Requirement(package_name))
                 dropped_dependencies.append(package)
 
             else:
                 packages_to_be_uploaded.append(str(package))
-            if package_name in native_packages:
-                native_packages.remove(package_name)
+            native_packages.discard(package_name)
         else:
             packages_to_be_uploaded.append(str(package))
 
@@ -329,23 +447,27 @@ def pip_install_packages_to_target_folder(
             [sys.executable, "-m", "pip"] if not pip_executable else [pip_executable]
         )
 
-        process = subprocess.Popen(
+        # subprocess.run drains both pipes while waiting and kills pip if the timeout expires
+        process = subprocess.run(
             pip_command + ["install", "-t", target, *packages],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             universal_newlines=True,
+            timeout=timeout,
+            check=False,
         )
-        stdout, stderr = process.communicate(timeout=timeout)
 
         pip_install_result: int = process.returncode
-        if stdout:
+        if process.stdout:
             process_output: str = "\n".join(
-                [line.strip() for line in stdout.split("\n")]
+                [line.strip() for line in process.stdout.split("\n")]
             )
             _logger.debug(process_output)
 
-        if stderr:  # pragma: no cover
-            error_output: str = "\n".join([line.strip() for line in stderr.split("\n")])
+        if process.stderr:  # pragma: no cover
+            error_output: str = "\n".join(
+                [line.strip() for line in process.stderr.split("\n")]
+            )
             _logger.warning(error_output)
     except FileNotFoundError:
         raise ModuleNotFoundError(
@@ -357,6 +479,30 @@ def pip_install_packages_to_target_folder(
         raise RuntimeError(f"Pip failed with return code {pip_install_result}.")
 
 
+def _iterate_files(root: str) -> Iterator[str]:
+    """
+    Yields the paths of all files under the `root` directory using a single recursive `os.scandir` walk. Symbolic
+    links to directories are not followed.
+
+    Args:
+        root (str): Directory to walk.
+
+    Returns:
+        Iterator[str]: Paths of the files found, prefixed by `root`.
+    """
+    directories: List[str] = [root]
+    while directories:
+        try:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    else:
+                        yield entry.path
+        except OSError:  # pragma: no cover
+            continue
+
+
 def detect_native_dependencies(
     target: str, downloaded_packages_dict: Dict[Requirement, List[str]]
 ) -> Set[str]:
@@ -405,69 +551,228 @@ def detect_native_dependencies(
 
         return record_entry_to_package_name_map
 
+    def iterate_top_level_entry_files(top_level_entry: str) -> Iterator[str]:
+        """
+        Yields the paths of files under a top level folder (or the top level file itself) of `target`.
+
+        Args:
+            top_level_entry (str): Name of a folder or file at the top level of `target`.
+
+        Returns:
+            Iterator[str]: Paths of the files found, prefixed by `target`.
+        """
+        top_level_path = os.path.join(target, top_level_entry)
+        if os.path.isdir(top_level_path):
+            yield from _iterate_files(top_level_path)
+        elif os.path.isfile(top_level_path):
+            yield top_level_path
+
     native_libraries: Set[str] = set()
+    if not downloaded_packages_dict:
+        return native_libraries
+
     record_entries_to_package_map: Dict[
         str, Set[str]
     ] = invert_downloaded_package_to_entry_map(downloaded_packages_dict)
 
-    for native_extension in NATIVE_FILE_EXTENSIONS:
-        base_search_string: str = os.path.join(target, f"*{native_extension}")
-        recursive_search_string: str = os.path.join(
-            target, "**", f"*{native_extension}"
-        )
-
-        glob_output: List[str] = glob.glob(base_search_string) + glob.glob(
-            recursive_search_string, recursive=True
-        )
-        if glob_output and len(glob_output) > 0:
-            for path in glob_output:
-                relative_path = os.path.relpath(path, target)
-
-                # Fetch record entry (either base directory or a file name)
-                record_entry = os.path.split(relative_path)[0]
-                if (
-                    record_entry == ""
-                ):  # Implies the relative_path is a file name at the base directory
-                    record_entry = relative_path
+    # Files that do not belong to any package cannot be attributed to a package, so we only walk the top level folders
+    # (or files) of record entries, along with the packages owning anything inside them.
+    top_level_entry_to_package_map: Dict[str, Set[str]] = {}
+    for record_entry, package_set in record_entries_to_package_map.items():
+        top_level_entry_to_package_map.setdefault(
+            record_entry.split("/")[0], set()
+        ).update(package_set)
+
+    target_prefix: str = os.path.join(target, "")
+    for top_level_entry, top_level_packages in top_level_entry_to_package_map.items():
+        # Stop looking for native files once all packages owning this folder are known to have native code
+        if top_level_packages <= native_libraries:
+            continue
+
+        for path in iterate_top_level_entry_files(top_level_entry):
+            if os.path.splitext(path)[1] not in NATIVE_FILE_EXTENSIONS:
+                continue
+            relative_path = path[len(target_prefix) :]
+
+            # Fetch record entry (either base directory or a file name)
+            record_entry = os.path.split(relative_path)[0]
+            if (
+                record_entry == ""
+            ):  # Implies the relative_path is a file name at the base directory
+                record_entry = relative_path
 
-                if "\\" in record_entry:
-                    record_entry = record_entry.replace("\\", "/")
+            if "\\" in record_entry:
+                record_entry = record_entry.replace("\\", "/")
 
-                # Check which packages own this record entry
-                if record_entry in record_entries_to_package_map:
-                    package_set = record_entries_to_package_map[record_entry]
-                    native_libraries.update(package_set)
+            # Check which packages own this record entry
+            if record_entry in record_entries_to_package_map:
+                package_set = record_entries_to_package_map[record_entry]
+                native_libraries.update(package_set)
+                if top_level_packages <= native_libraries:
+                    break
 
     _logger.info(f"Potential native libraries: {native_libraries}")
     return native_libraries
 
 
+def _deflate_file(path: str) -> Tuple[bytes, int, int]:
+    """
+    Reads a file and compresses its contents into a raw DEFLATE stream, as stored in zip archives. zlib releases the
+    GIL while compressing, so this can run on several threads at once.
+
+    Args:
+        path (str): Path of the file to compress.
+
+    Returns:
+        Tuple[bytes, int, int]: The compressed contents, the CRC-32 and the size of the uncompressed contents.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    compressor = zlib.compressobj(1, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed_data = compressor.compress(data) + compressor.flush()
+    return compressed_data, zlib.crc32(data), len(data)
+
+
+def _write_deflated_file(
+    zipf: zipfile.ZipFile,
+    zinfo: zipfile.ZipInfo,
+    compressed_data: bytes,
+    crc: int,
+    file_size: int,
+) -> None:
+    """
+    Writes a member whose contents were already compressed by `_deflate_file` to an open zip archive. `zipfile` has no
+    public API to add pre-compressed data, so this mirrors what `ZipFile.open(zinfo, "w")` does for a seekable file.
+    It relies on the private `_writecheck`, `_didModify`, `fp`, `start_dir`, `filelist` and `NameToInfo` members of
+    `ZipFile`, which were checked against CPython 3.8, 3.9, 3.10, 3.11, 3.12 and 3.13.
+
+    Args:
+        zipf (zipfile.ZipFile): Zip archive opened for writing.
+        zinfo (zipfile.ZipInfo): Metadata of the member to write.
+        compressed_data (bytes): Raw DEFLATE stream of the member contents.
+        crc (int): CRC-32 of the uncompressed contents.
+        file_size (int): Size of the uncompressed contents.
+    """
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = len(compressed_data)
+    zip64 = max(file_size, zinfo.compress_size) > zipfile.ZIP64_LIMIT
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    zipf.fp.write(compressed_data)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+
+def _write_stored_file(zipf: zipfile.ZipFile, path: str, arcname: str) -> None:
+    """
+    Writes a file to an open zip archive without compressing it, copying its contents in large chunks.
+
+    Args:
+        zipf (zipfile.ZipFile): Zip archive opened for writing.
+        path (str): Path of the file to write.
+        arcname (str): Name of the member in the archive.
+    """
+    zinfo = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+    zinfo.compress_type = zipfile.ZIP_STORED
+    with open(path, "rb", buffering=_ZIP_WRITE_BUFFER_SIZE) as src, zipf.open(
+        zinfo, "w"
+    ) as dest:
+        shutil.copyfileobj(src, dest, _ZIP_WRITE_BUFFER_SIZE)
+
+
 def zip_directory_contents(target: str, output_path: str) -> None:
     """
     Zips all files/folders inside the directory path as well as those installed one level up from the directory path.
+    Files inside the directory path are compressed in parallel on a thread pool, apart from large files, which are
+    streamed into the zip file one at a time.
 
     Args:
         target (str): Target directory (absolute path) which contains packages installed by pip.
         output_path (str): Absolute path for output zip file.
     """
-    target = Path(target)
-    output_path = Path(output_path)
+    target = os.path.normpath(target)
+    output_path = os.path.normpath(output_path)
+    target_prefix: str = os.path.join(target, "")
     with zipfile.ZipFile(
-        output_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True
+        output_path,
+        "w",
+        zipfile.ZIP_DEFLATED,
+        allowZip64=True,
+        compresslevel=1,
+        strict_timestamps=False,
     ) as zipf:
-        for file in target.rglob("*"):
-            zipf.write(file, file.relative_to(target))
+        # Compressed members are written in the order they were submitted, so the same target always gives the same
+        # zip file, and new files are only submitted while the ones in flight fit in _PARALLEL_DEFLATE_BUFFER_SIZE, so
+        # memory use does not grow with the size of the target
+        in_flight: Deque[Tuple[Future, zipfile.ZipInfo]] = deque()
+        in_flight_size = 0
+
+        def write_next_deflated_file() -> None:
+            """Waits for the oldest file being compressed and writes it to the zip file."""
+            nonlocal in_flight_size
+            future, zinfo = in_flight.popleft()
+            in_flight_size -= zinfo.file_size
+            _write_deflated_file(zipf, zinfo, *future.result())
+
+        with ThreadPoolExecutor() as executor:
+            for root, directories, files in os.walk(target):
+                relative_root = root[len(target_prefix) :]
+                for directory in directories:
+                    zipf.write(
+                        os.path.join(root, directory),
+                        os.path.join(relative_root, directory),
+                    )
+                for file in files:
+                    path = os.path.join(root, file)
+                    arcname = os.path.join(relative_root, file)
+                    if os.path.splitext(file)[1].lower() in COMPRESSED_FILE_EXTENSIONS:
+                        _write_stored_file(zipf, path, arcname)
+                        continue
+                    zinfo = zipfile.ZipInfo.from_file(
+                        path, arcname, strict_timestamps=False
+                    )
+                    if zinfo.file_size > _PARALLEL_DEFLATE_MAX_FILE_SIZE:
+                        zipf.write(path, arcname)
+                        continue
+                    while (
+                        in_flight
+                        and in_flight_size + zinfo.file_size
+                        > _PARALLEL_DEFLATE_BUFFER_SIZE
+                    ):
+                        write_next_deflated_file()
+                    in_flight.append((executor.submit(_deflate_file, path), zinfo))
+                    in_flight_size += zinfo.file_size
+            while in_flight:
+                write_next_deflated_file()
+
+        parent_directory = os.path.dirname(target)
+
+        with os.scandir(parent_directory) as entries:
+            for entry in entries:
+                if (
+                    entry.is_file()
+                    and not entry.name.startswith(".")
+                    and entry.path != output_path
+                ):
+                    zipf.write(entry.path, entry.name)
 
-        parent_directory = target.parent
 
-        for file in parent_directory.iterdir():
-            if (
-                file.is_file()
-                and not file.match(".*")
-                and file != output_path
-                and file != target
-            ):
-                zipf.write(file, file.relative_to(parent_directory))
+@functools.lru_cache(maxsize=1)
+def _get_local_snowpark_version() -> str:
+    """
+    Returns the version of the Snowpark Python package installed in the local environment. The installed version does
+    not change while the process is running, so the distribution is only looked up once.
+
+    Raises:
+        importlib.metadata.PackageNotFoundError: If the Snowpark Python Package is not installed in the local
+        environment.
+    """
+    return importlib.metadata.version(SNOWPARK_PACKAGE_NAME)
 
 
 def add_snowpark_package(
@@ -483,14 +788,13 @@ def add_snowpark_package(
         channel.
 
     Raises:
-        pkg_resources.DistributionNotFound: If the Snowpark Python Package is not installed in the local environment.
+        importlib.metadata.PackageNotFoundError: If the Snowpark Python Package is not installed in the local
+        environment.
     """
     if SNOWPARK_PACKAGE_NAME not in package_dict:
         package_dict[SNOWPARK_PACKAGE_NAME] = SNOWPARK_PACKAGE_NAME
         try:
-            package_client_version = pkg_resources.get_distribution(
-                SNOWPARK_PACKAGE_NAME
-            ).version
+            package_client_version = _get_local_snowpark_version()
             if package_client_version in valid_packages[SNOWPARK_PACKAGE_NAME]:
                 package_dict[
                     SNOWPARK_PACKAGE_NAME
@@ -501,7 +805,7 @@ def add_snowpark_package(
                     f"{package_client_version}, which is not available in Snowflake. Your UDF might not work when "
                     f"the package version is different between the server and your local environment."
                 )
-        except pkg_resources.DistributionNotFound:
+        except importlib.metadata.PackageNotFoundError:
             _logger.warning(
                 f"Package '{SNOWPARK_PACKAGE_NAME}' is not installed in the local environment. "
                 f"Your UDF might not work when the package is installed on the server "
@@ -170,10 +170,8 @@ class DefaultMethod:
             df = cls.frame_wrapper(df)
             result = fn(df, *args, **kwargs)
 
-            if not isinstance(
-                result, pandas.Series
-            ) and not isinstance(  # pragma: no cover
-                result, pandas.DataFrame
+            if not isinstance(  # pragma: no cover
+                result, (pandas.Series, pandas.DataFrame)
             ):
                 # When applying a DatetimeProperties or TimedeltaProperties function,
                 # if we don't specify the dtype for the DataFrame, the frame might
@@ -23,6 +23,7 @@ from typing import Any, Dict, List, Literal, Optional, Sequence, Set, Tuple, Uni
 
 import cloudpickle
 import pkg_resources
+from packaging.requirements import Requirement
 
 from snowflake.connector import ProgrammingError, SnowflakeConnection
 from snowflake.connector.options import installed_pandas, pandas
@@ -55,6 +56,7 @@ from snowflake.snowpark._internal.packaging_utils import (
     IMPLICIT_ZIP_FILE_NAME,
     delete_files_belonging_to_packages,
     detect_native_dependencies,
+    get_requirement_version,
     get_signature,
     identify_supported_packages,
     map_python_packages_to_files_and_folders,
@@ -1302,7 +1304,7 @@ class Session:
         elif len(errors) > 0:
             raise RuntimeError(errors)
 
-        dependency_packages: List[pkg_resources.Requirement] = []
+        dependency_packages: List[Requirement] = []
         if len(unsupported_packages) != 0:
             _logger.warning(
                 f"The following packages are not available in Snowflake: {unsupported_packages}."
@@ -1408,7 +1410,7 @@ class Session:
         # Add dependency packages
         for package in dependency_packages:
             name = package.name
-            version = package.specs[0][1] if package.specs else None
+            version = get_requirement_version(package)
 
             if name in result_dict:
                 if version is not None:
@@ -1436,7 +1438,7 @@ class Session:
         packages: List[str],
         package_table: str,
         package_dict: Dict[str, str],
-    ) -> List[pkg_resources.Requirement]:
+    ) -> List[Requirement]:
         """
         Uploads a list of Pypi packages, which are unavailable in Snowflake, to session stage.
 
@@ -1447,7 +1449,7 @@ class Session:
                 been added explicitly so far using add_packages() or other such methods.
 
         Returns:
-            List[pkg_resources.Requirement]: List of package dependencies (present in Snowflake) that would need to be added
+            List[Requirement]: List of package dependencies (present in Snowflake) that would need to be added
             to the package dictionary.
 
         Raises:
@@ -1597,7 +1599,7 @@ class Session:
 
     def _load_unsupported_packages_from_stage(
         self, environment_signature: str
-    ) -> List[pkg_resources.Requirement]:
+    ) -> List[Requirement]:
         """
         Uses specified stage path to auto-import a group of unsupported packages, along with its dependencies. This
         saves time spent on pip install, native package detection and zip upload to stage.
@@ -1618,7 +1620,7 @@ class Session:
             environment_signature (str): Unique hash signature for a set of unsupported packages, computed by hashing
             a sorted tuple of unsupported package requirements (package versioning included).
         Returns:
-            Optional[List[pkg_resources.Requirement]]: A list of package dependencies for the set of unsupported packages requested.
+            Optional[List[Requirement]]: A list of package dependencies for the set of unsupported packages requested.
         """
         cache_path = self._custom_package_usage_config["cache_path"]
         # Ensure that metadata file exists
@@ -1652,8 +1654,7 @@ class Session:
         }
 
         dependency_packages = [
-            pkg_resources.Requirement.parse(package)
-            for package in metadata[environment_signature]
+            Requirement(package) for package in metadata[environment_signature]
         ]
         _logger.info(
             f"Loading dependency packages list - {metadata[environment_signature]}."
@@ -3,10 +3,11 @@
 #
 
 import datetime
+import hashlib
 import logging
 import os
+import platform
 import sys
-import tempfile
 from unittest.mock import patch
 
 import pytest
@@ -18,7 +19,7 @@ from snowflake.snowpark._internal.packaging_utils import (
     IMPLICIT_ZIP_FILE_NAME,
     get_signature,
 )
-from snowflake.snowpark.functions import call_udf, col, count_distinct, sproc, udf
+from snowflake.snowpark.functions import call_udf, lit, sproc, udf
 from snowflake.snowpark.types import DateType, StringType
 from tests.utils import IS_IN_STORED_PROC, TempObjectType, TestFiles, Utils
 
@@ -46,54 +47,93 @@ try:
 except ImportError:
     is_pandas_and_numpy_available = False
 
+# Returned by the probe_udf UDFs when the module cannot be imported
+MODULE_NOT_FOUND = "ERR:ModuleNotFoundError"
 
-@pytest.fixture(scope="module", autouse=True)
-def setup(session, resources_path, local_testing_mode):
-    tmp_stage_name = Utils.random_stage_name()
-    test_files = TestFiles(resources_path)
-    if not local_testing_mode:
-        Utils.create_stage(session, tmp_stage_name, is_temporary=True)
-    Utils.upload_to_stage(
-        session, tmp_stage_name, test_files.test_udf_py_file, compress=False
+# Reuse the cached custom package environment that an earlier test run left on a persistent stage
+REUSE_PERSIST_STAGE = os.getenv("SNOWPARK_TEST_REUSE_PERSIST_STAGE") == "1"
+
+
+def _probe(session, udf_name, *args):
+    """Evaluates a scalar UDF once and returns its value."""
+    return (
+        session.range(1)
+        .select(call_udf(udf_name, *(lit(arg) for arg in args)))
+        .collect()[0][0]
     )
 
 
+@pytest.fixture(scope="module")
+def test_files(resources_path):
+    return TestFiles(resources_path)
+
+
+@pytest.fixture(scope="module")
+def _pristine_state(session):
+    return dict(session._packages), dict(session._import_paths)
+
+
 @pytest.fixture(autouse=True)
-def clean_up(session):
-    session._session_stage = Utils.random_stage_name()
-    session._stage_created = False
-    session.clear_packages()
-    session.clear_imports()
+def clean_up(request, session, _pristine_state):
+    yield
+    packages, import_paths = _pristine_state
+    session._packages = dict(packages)
+    if session._import_paths != import_paths:
+        # clear_imports also drops the imports cached by the local testing udf/sproc registrations
+        session.clear_imports()
+        session._import_paths.update(import_paths)
     session.custom_package_usage_config = {}
     session._runtime_version_from_requirement = None
+    # only tests that push files to the session stage get a fresh one
+    if request.node.get_closest_marker("mutates_stage"):
+        session._session_stage = Utils.random_stage_name()
+        session._stage_created = False
+
+
+@pytest.fixture(scope="session")
+def available_versions_cache():
+    return {}
 
 
 @pytest.fixture(autouse=True)
-def get_available_versions_for_packages_patched(session):
+def get_available_versions_for_packages_patched(session, available_versions_cache):
     # Save a reference to the original function
     original_function = session._get_available_versions_for_packages
     sentinel_version = "0.0.1"
 
     with patch.object(session, "_get_available_versions_for_packages") as mock_function:
 
-        def side_effect(package_names, *args, **kwargs):
-            sktime_found = False
-            scikit_fuzzy_found = False
-            catboost_found = False
-            for name in package_names:
-                if name == "sktime":
-                    sktime_found = True
-                elif name == "scikit-fuzzy":
-                    scikit_fuzzy_found = True
-                elif name == "catboost":
-                    catboost_found = True
-
-            result = original_function(package_names, *args, **kwargs)
-            if sktime_found:
+        def side_effect(
+            package_names,
+            package_table_name,
+            validate_package=True,
+            statement_params=None,
+        ):
+            # information_schema.packages does not change during a test run, so each
+            # distinct lookup only needs to be sent to the server once
+            key = hashlib.blake2b(
+                "|".join(
+                    [package_table_name, str(validate_package), *sorted(package_names)]
+                ).encode(),
+                digest_size=16,
+            ).digest()
+            if key not in available_versions_cache:
+                available_versions_cache[key] = original_function(
+                    package_names,
+                    package_table_name,
+                    validate_package=validate_package,
+                    statement_params=statement_params,
+                )
+            cached = available_versions_cache[key]
+            if cached is None:
+                return None
+            result = {name: list(versions) for name, versions in cached.items()}
+
+            if "sktime" in package_names:
                 result.update({"sktime": [sentinel_version]})
-            if scikit_fuzzy_found:
+            if "scikit-fuzzy" in package_names:
                 result.update({"scikit-fuzzy": [sentinel_version]})
-            if catboost_found and "catboost" in result.keys():
+            if "catboost" in package_names and "catboost" in result.keys():
                 result.pop("catboost")
             return result
 
@@ -109,52 +149,63 @@ def temporary_stage(session, local_testing_mode):
     yield temporary_stage_name
 
 
-@pytest.fixture(scope="function")
-def bad_yaml_file():
-    # Generate a bad YAML string
-    bad_yaml = """
-    some_key: some_value:
-        - list_item1
-        - list_item2
+@pytest.fixture(scope="module")
+def probe_udf(session):
     """
-
-    # Write the bad YAML to a temporary file
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".yaml") as file:
-        file.write(bad_yaml)
-        file_path = file.name
-
-    yield file_path
-
-    # Clean up the temporary file after the test completes
-    if file_path:
-        os.remove(file_path)
-
-
-@pytest.fixture(scope="function")
-def ranged_yaml_file():
-    # Generate a bad YAML string
-    bad_yaml = """
-    name: my_environment  # Name of the environment
-    channels:  # List of Conda channels to use for package installation
-      - conda-forge
-      - defaults
-    dependencies:  # List of packages and versions to include in the environment
-      - python=3.9  # Python version
-      - numpy<=1.24.3
+    Returns a function that gives the name of a UDF which reports the ``__version__`` of the module it is called
+    with, an empty string if the module has no ``__version__``, or ``MODULE_NOT_FOUND`` if it cannot be imported. A UDF is
+    only registered the first time a package list, the session packages, imports and custom package usage config are
+    seen together, and reused afterwards.
     """
 
-    # Write the ranged YAML to a temporary file
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".yaml") as file:
-        file.write(bad_yaml)
-        file_path = file.name
-
-    yield file_path
-
-    # Clean up the temporary file after the test completes
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
+    def probe_module(name: str) -> str:
+        import importlib
 
+        try:
+            module = importlib.import_module(name)
+        except ModuleNotFoundError:
+            return "ERR:ModuleNotFoundError"
+        return getattr(module, "__version__", "")
+
+    probes = {}
+
+    def get_probe(packages=None):
+        key = (
+            packages is None,
+            tuple(
+                sorted(
+                    packages
+                    if packages is not None
+                    else session.get_packages().values()
+                )
+            ),
+            tuple(session.get_imports()),
+            str(sorted(session.custom_package_usage_config.items())),
+        )
+        if key not in probes:
+            udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
+            session.udf.register(probe_module, name=udf_name, packages=packages)
+            probes[key] = udf_name
+        return probes[key]
+
+    return get_probe
+
+
+@pytest.fixture(scope="module")
+def persistent_ci_stage(connection, db_parameters, test_files):
+    # The per-run test schema is dropped at the end of the session, so keep the stage in the configured schema
+    stage_name = f"{db_parameters['database']}.{db_parameters['schema_with_secret']}.snowpark_ci_persist_cache"
+    with connection.cursor() as cursor:
+        cursor.execute(f"create stage if not exists {stage_name}")
+    # Cached environments are only valid for the Python version, platform and requirements that built them
+    with open(test_files.test_unsupported_requirements_file, "rb") as f:
+        requirements_hash = hashlib.sha1(f.read()).hexdigest()
+    python_version = f"{sys.version_info.major}{sys.version_info.minor}"
+    platform_name = f"{platform.system()}_{platform.machine()}".lower()
+    yield f"{stage_name}/py{python_version}_{platform_name}_{requirements_hash}"
+
+
+@pytest.mark.xdist_group(name="packaging_nopip")
 def test_patch_on_get_available_versions_for_packages(session):
     """
     Assert that the utility function get_available_versions_for_packages() is patched for custom packages. This ensures
@@ -183,7 +234,7 @@ def test_patch_on_get_available_versions_for_packages(session):
     (not is_pandas_and_numpy_available) or IS_IN_STORED_PROC,
     reason="numpy and pandas are required",
 )
-def test_add_packages(session, local_testing_mode):
+def test_add_packages(session, local_testing_mode, probe_udf):
     session.add_packages(
         [
             "numpy==1.23.5",
@@ -206,8 +257,7 @@ def test_add_packages(session, local_testing_mode):
     udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
     session.udf.register(get_numpy_pandas_dateutil_version, name=udf_name)
 
-    df = session.create_dataframe([None]).to_df("a")
-    res = df.select(call_udf(udf_name)).collect()[0][0]
+    res = _probe(session, udf_name)
     # don't need to check the version of dateutil, as it can be changed on the server side
     assert (
         res.startswith("1.23.5/1.5.3")
@@ -217,40 +267,18 @@ def test_add_packages(session, local_testing_mode):
 
     # only add pyyaml, which will overwrite the previously added packages
     # so matplotlib will not be available on the server side
-    def is_matplotlib_available() -> bool:
-        try:
-            import matplotlib.pyplot as plt  # noqa: F401
-        except ModuleNotFoundError:
-            return False
-        return True
-
-    session.udf.register(
-        is_matplotlib_available, name=udf_name, replace=True, packages=["pyyaml"]
-    )
-    Utils.check_answer(df.select(call_udf(udf_name)), [Row(False)])
+    pyyaml_probe = probe_udf(["pyyaml"])
+    assert _probe(session, pyyaml_probe, "matplotlib.pyplot") == MODULE_NOT_FOUND
 
     # with an empty list of udf-level packages
     # it will still fail even if we have session-level packages
-    def is_yaml_available() -> bool:
-        try:
-            import yaml  # noqa: F401
-        except ModuleNotFoundError:
-            return False
-        return True
-
-    session.udf.register(is_yaml_available, name=udf_name, replace=True, packages=[])
+    res = _probe(session, probe_udf([]), "yaml")
     # in local testing dev setup, yaml is locally available as part of the install requirements
-    Utils.check_answer(
-        df.select(call_udf(udf_name)),
-        [Row(False)] if not local_testing_mode else [Row(True)],
-    )
+    assert (res == MODULE_NOT_FOUND) != local_testing_mode
 
     session.clear_packages()
 
-    session.udf.register(
-        is_yaml_available, name=udf_name, replace=True, packages=["pyyaml"]
-    )
-    Utils.check_answer(df.select(call_udf(udf_name)), [Row(True)])
+    assert _probe(session, pyyaml_probe, "yaml") != MODULE_NOT_FOUND
 
     session.clear_packages()
 
@@ -270,13 +298,12 @@ def test_add_packages(session, local_testing_mode):
 @pytest.mark.udf
 def test_add_packages_with_underscore(session):
     packages = ["spacy-model-en_core_web_sm", "typing_extensions"]
-    count = (
-        session.table("information_schema.packages")
-        .where(col("package_name").in_(packages))
-        .select(count_distinct("package_name"))
-        .collect()[0][0]
-    )
-    if count != len(packages):
+    rows = session._conn.run_query(
+        "select distinct package_name from information_schema.packages "
+        "where language = 'python' and package_name in (?, ?)",
+        params=packages,
+    )["data"]
+    if len(rows) != len(packages):
         pytest.skip("These packages with underscores are not available")
 
     udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
@@ -292,9 +319,10 @@ def test_add_packages_with_underscore(session):
         except Exception:
             return False
 
-    Utils.check_answer(session.sql(f"select {udf_name}()").collect(), [Row(True)])
+    assert _probe(session, udf_name)
 
 
+@pytest.mark.xdist_group(name="packaging_nopip")
 @pytest.mark.localtest
 @pytest.mark.udf
 def test_add_packages_with_underscore_and_versions(session):
@@ -365,9 +393,7 @@ def test_add_packages_negative(session, caplog):
     (not is_pandas_and_numpy_available) or IS_IN_STORED_PROC,
     reason="numpy and pandas are required",
 )
-def test_add_requirements(session, resources_path, local_testing_mode):
-    test_files = TestFiles(resources_path)
-
+def test_add_requirements(session, test_files, local_testing_mode):
     session.add_requirements(test_files.test_requirements_file)
     assert session.get_packages() == {
         "numpy": "numpy==1.23.5",
@@ -380,22 +406,18 @@ def test_add_requirements(session, resources_path, local_testing_mode):
     def get_numpy_pandas_version() -> str:
         return f"{numpy.__version__}/{pandas.__version__}"
 
-    df = session.create_dataframe([None]).to_df("a")
-    res = df.select(call_udf(udf_name))
-    Utils.check_answer(
-        res,
-        [Row("1.23.5/1.5.3")]
+    assert _probe(session, udf_name) == (
+        "1.23.5/1.5.3"
         if not local_testing_mode
-        else [Row(f"{numpy.__version__}/{pandas.__version__}")],
+        else f"{numpy.__version__}/{pandas.__version__}"
     )
 
 
+@pytest.mark.xdist_group(name="packaging_nopip")
 @pytest.mark.localtest
 def test_add_requirements_twice_should_fail_if_packages_are_different(
-    session, resources_path
+    session, test_files
 ):
-    test_files = TestFiles(resources_path)
-
     session.add_requirements(test_files.test_requirements_file)
     assert session.get_packages() == {
         "numpy": "numpy==1.23.5",
@@ -406,14 +428,14 @@ def test_add_requirements_twice_should_fail_if_packages_are_different(
         session.add_packages(["numpy==1.23.4"])
 
 
+@pytest.mark.xdist_group(name="packaging_nopip")
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
     reason="Subprocess calls are not allowed within stored procedures.",
 )
 def test_add_unsupported_requirements_should_fail_if_custom_packages_upload_enabled_not_switched_on(
-    session, resources_path
+    session, test_files
 ):
-    test_files = TestFiles(resources_path)
     with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
         with pytest.raises(
             RuntimeError,
@@ -422,6 +444,7 @@ def test_add_unsupported_requirements_should_fail_if_custom_packages_upload_enab
             session.add_requirements(test_files.test_unsupported_requirements_file)
 
 
+@pytest.mark.xdist_group(name="packaging_nopip")
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
     reason="Subprocess calls are not allowed within stored procedures.",
@@ -437,15 +460,15 @@ def test_add_unsupported_packages_should_fail_if_custom_packages_upload_enabled_
             session.add_packages("sktime==0.20.0")
 
 
+@pytest.mark.mutates_stage
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
     reason="Subprocess calls are not allowed within stored procedures. Unsupported package upload does not work well on Windows.",
 )
 def test_add_unsupported_requirements_twice_should_not_fail_for_same_requirements_file(
-    session, resources_path
+    session, test_files
 ):
     session.custom_package_usage_config = {"enabled": True}
-    test_files = TestFiles(resources_path)
 
     with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
         session.add_requirements(test_files.test_unsupported_requirements_file)
@@ -463,6 +486,7 @@ def test_add_unsupported_requirements_twice_should_not_fail_for_same_requirement
         assert "pyyaml" in package_set
 
 
+@pytest.mark.mutates_stage
 @pytest.mark.xfail(reason="SNOW-948834 flaky test", strict=False)
 @pytest.mark.udf
 @pytest.mark.skipif(
@@ -492,20 +516,20 @@ def test_add_packages_should_fail_if_dependency_package_already_added(session):
                 pandas.__name__ + "/" + str(pandas.__version__),
             ]
 
-        Utils.check_answer(
-            session.sql(f"select {udf_name}()"),
-            [Row('[\n  "arch/6.1.0",\n  "scipy/1.11.1",\n  "pandas/1.5.3"\n]')],
+        assert (
+            _probe(session, udf_name)
+            == '[\n  "arch/6.1.0",\n  "scipy/1.11.1",\n  "pandas/1.5.3"\n]'
         )
 
 
+@pytest.mark.mutates_stage
 @pytest.mark.udf
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
     reason="Subprocess calls are not allowed within stored procedures.",
 )
-def test_add_requirements_unsupported_usable_by_udf(session, resources_path):
+def test_add_requirements_unsupported_usable_by_udf(session, test_files, probe_udf):
     session.custom_package_usage_config = {"enabled": True}
-    test_files = TestFiles(resources_path)
 
     with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
         session.add_requirements(test_files.test_unsupported_requirements_file)
@@ -516,25 +540,16 @@ def test_add_requirements_unsupported_usable_by_udf(session, resources_path):
         assert "matplotlib" in package_set
         assert "pyyaml" in package_set
 
-    udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
-
-    @udf(name=udf_name)
-    def import_scikit_fuzzy() -> str:
-        import skfuzzy as fuzz
-
-        return fuzz.__version__
-
-    Utils.check_answer(session.sql(f"select {udf_name}()"), [Row("0.4.2")])
+    assert _probe(session, probe_udf(), "skfuzzy") == "0.4.2"
 
 
+@pytest.mark.mutates_stage
 @pytest.mark.udf
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
     reason="Subprocess calls are not allowed within stored procedures.",
 )
-def test_add_requirements_unsupported_usable_by_sproc(session, resources_path):
-    test_files = TestFiles(resources_path)
-
+def test_add_requirements_unsupported_usable_by_sproc(session, test_files):
     session.custom_package_usage_config = {"enabled": True}
     with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
         session.add_requirements(test_files.test_unsupported_requirements_file)
@@ -557,6 +572,7 @@ def test_add_requirements_unsupported_usable_by_sproc(session, resources_path):
     assert run_scikit_fuzzy(session) == "0.4.2"
 
 
+@pytest.mark.mutates_stage
 @pytest.mark.udf
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
@@ -578,10 +594,7 @@ def test_add_requirements_with_native_dependency_force_push(session):
             return "does not work"
 
     # Unsupported native dependency, the code doesn't run
-    Utils.check_answer(
-        session.sql(f"select {udf_name}()").collect(),
-        [Row("does not work")],
-    )
+    assert _probe(session, udf_name) == "does not work"
 
 
 @pytest.mark.skipif(
@@ -597,16 +610,12 @@ def test_add_packages_with_native_dependency_without_force_push(session):
             session.add_packages(["catboost==1.2"])
 
 
-@pytest.fixture(scope="function")
-def requirements_file_with_local_path():
-    # Write a local script to a temporary file
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".py`") as file:
-        file.write("VARIABLE_IN_LOCAL_FILE = 50")
-        local_script_path = file.name
-
-    local_script_basedir = os.path.dirname(local_script_path)
-    new_path = os.path.join(local_script_basedir, "nicename.py")
-    os.rename(local_script_path, new_path)
+@pytest.fixture(scope="module")
+def requirements_file_with_local_path(tmp_path_factory):
+    # Write a local script to a temporary directory
+    local_script_basedir = tmp_path_factory.mktemp("local_script")
+    new_path = local_script_basedir / "nicename.py"
+    new_path.write_text("VARIABLE_IN_LOCAL_FILE = 50")
 
     # Generate a requirements file
     requirements = f"""
@@ -614,19 +623,12 @@ def requirements_file_with_local_path():
     matplotlib
     {new_path}
     """
-    # Write the bad YAML to a temporary file
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".txt") as file:
-        file.write(requirements)
-        requirements_path = file.name
-
-    yield requirements_path
-
-    # Clean up the temporary files after the test completes
-    for path in {requirements_path, local_script_path, new_path}:
-        if os.path.exists(path):
-            os.remove(path)
+    requirements_path = local_script_basedir / "requirements.txt"
+    requirements_path.write_text(requirements)
+    return str(requirements_path)
 
 
+@pytest.mark.mutates_stage
 @pytest.mark.udf
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
@@ -653,12 +655,10 @@ def test_add_requirements_with_local_filepath(
 
         return f"{VARIABLE_IN_LOCAL_FILE + 10}"
 
-    Utils.check_answer(session.sql(f"select {udf_name}()"), [Row("60")])
+    assert _probe(session, udf_name) == "60"
 
 
-def test_add_requirements_yaml(session, resources_path):
-    test_files = TestFiles(resources_path)
-
+def test_add_requirements_yaml(session, test_files):
     with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
         session.add_requirements(test_files.test_conda_environment_file)
     assert session.get_packages().keys() == {
@@ -697,56 +697,26 @@ def test_add_requirements_yaml(session, resources_path):
 
             return f"{sns.__version__}/{scipy.__version__}"
 
-        Utils.check_answer(session.sql(f"select {udf_name}()"), [Row("0.11.1/1.10.1")])
-
-
-@pytest.mark.localtest
-def test_add_requirements_with_bad_yaml(session, bad_yaml_file):
-    with pytest.raises(
-        ValueError,
-        match="Error while parsing YAML file, it may not be a valid Conda environment file",
-    ):
-        session.add_requirements(bad_yaml_file)
-
-
-@pytest.mark.localtest
-def test_add_requirements_with_ranged_requirements_in_yaml(session, ranged_yaml_file):
-    with pytest.raises(
-        ValueError,
-        match="Conda dependency with ranges 'numpy<=1.24.3' is not supported",
-    ):
-        session.add_requirements(ranged_yaml_file)
+        assert _probe(session, udf_name) == "0.11.1/1.10.1"
 
 
+@pytest.mark.mutates_stage
 @pytest.mark.udf
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
     reason="Subprocess calls are not allowed within stored procedures.",
 )
-def test_add_packages_unsupported_during_udf_registration(session):
+def test_add_packages_unsupported_during_udf_registration(session, probe_udf):
     """
     Assert that unsupported packages can directly be added while registering UDFs.
     """
     session.custom_package_usage_config = {"enabled": True}
     with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
-        packages = ["scikit-fuzzy==0.4.2"]
-        udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
-
-        @udf(name=udf_name, packages=packages)
-        def check_if_package_works() -> str:
-            try:
-                import skfuzzy as fuzz
-
-                return fuzz.__version__
-            except Exception as e:
-                return f"Import statement does not work: {e.__repr__()}"
-
-        Utils.check_answer(
-            session.sql(f"select {udf_name}()").collect(),
-            [Row("0.4.2")],
-        )
+        udf_name = probe_udf(["scikit-fuzzy==0.4.2"])
+        assert _probe(session, udf_name, "skfuzzy") == "0.4.2"
 
 
+@pytest.mark.mutates_stage
 @pytest.mark.udf
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
@@ -773,6 +743,7 @@ def test_add_packages_unsupported_during_sproc_registration(session):
         assert check_if_package_works() == "0.4.2"
 
 
+@pytest.mark.mutates_stage
 @pytest.mark.udf
 @pytest.mark.skipif(not is_dateutil_available, reason="dateutil is required")
 def test_add_import_package(session):
@@ -797,12 +768,11 @@ def test_add_import_package(session):
     reason="numpy and pandas are required",
 )
 def test_add_requirements_with_empty_stage_as_cache_path(
-    session, resources_path, temporary_stage
+    session, test_files, temporary_stage, probe_udf
 ):
     """
     Assert that adding a cache_path (empty stage) does not affect the requirements addition process.
     """
-    test_files = TestFiles(resources_path)
     session.custom_package_usage_config = {
         "enabled": True,
         "cache_path": temporary_stage,
@@ -814,15 +784,8 @@ def test_add_requirements_with_empty_stage_as_cache_path(
         "pandas": "pandas==1.5.3",
     }
 
-    udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
-
-    @udf(name=udf_name, packages=["snowflake-snowpark-python==1.8.0"])
-    def get_numpy_pandas_version() -> str:
-        import snowflake.snowpark as snowpark
-
-        return f"{snowpark.__version__}"
-
-    Utils.check_answer(session.sql(f"select {udf_name}()"), [Row("1.8.0")])
+    udf_name = probe_udf(["snowflake-snowpark-python==1.8.0"])
+    assert _probe(session, udf_name, "snowflake.snowpark") == "1.8.0"
 
 
 @pytest.mark.udf
@@ -831,13 +794,12 @@ def test_add_requirements_with_empty_stage_as_cache_path(
     reason="Subprocess calls are not allowed within stored procedures.",
 )
 def test_add_requirements_unsupported_with_empty_stage_as_cache_path(
-    session, resources_path, temporary_stage
+    session, test_files, temporary_stage, probe_udf
 ):
     """
     Assert that adding a cache_path (empty stage) does not affect the requirements addition process, even if
     requirements are unsupported.
     """
-    test_files = TestFiles(resources_path)
 
     session.custom_package_usage_config = {
         "enabled": True,
@@ -852,15 +814,7 @@ def test_add_requirements_unsupported_with_empty_stage_as_cache_path(
     assert "matplotlib" in package_set
     assert "pyyaml" in package_set
 
-    udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
-
-    @udf(name=udf_name)
-    def get_skfuzzy_version() -> str:
-        import skfuzzy as fuzz
-
-        return fuzz.__version__
-
-    Utils.check_answer(session.sql(f"select {udf_name}()"), [Row("0.4.2")])
+    assert _probe(session, probe_udf(), "skfuzzy") == "0.4.2"
 
 
 @pytest.mark.skipif(
@@ -868,12 +822,11 @@ def test_add_requirements_unsupported_with_empty_stage_as_cache_path(
     reason="Subprocess calls are not allowed within stored procedures.",
 )
 def test_add_requirements_unsupported_with_cache_path_negative(
-    session, resources_path, temporary_stage
+    session, test_files, temporary_stage
 ):
     """
     Assert that adding a non-existent stage as cache_path fails gracefully.
     """
-    test_files = TestFiles(resources_path)
     session.custom_package_usage_config = {
         "enabled": True,
         "cache_path": "arbitrary_name_for_not_existent_stages",
@@ -889,13 +842,12 @@ def test_add_requirements_unsupported_with_cache_path_negative(
     reason="Subprocess calls are not allowed within stored procedures.",
 )
 def test_add_requirements_unsupported_with_cache_path_works_even_if_caching_fails(
-    session, resources_path, temporary_stage
+    session, test_files, temporary_stage, probe_udf
 ):
     """
     Assert that failure in loading environment from `cache_path` does not affect the requirements addition process,
     even if requirements are unsupported.
     """
-    test_files = TestFiles(resources_path)
     session.custom_package_usage_config = {
         "enabled": True,
         "cache_path": temporary_stage,
@@ -914,15 +866,7 @@ def test_add_requirements_unsupported_with_cache_path_works_even_if_caching_fail
     assert "matplotlib" in package_set
     assert "pyyaml" in package_set
 
-    udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
-
-    @udf(name=udf_name)
-    def get_numpy_pandas_version() -> str:
-        import skfuzzy as fuzz
-
-        return fuzz.__version__
-
-    Utils.check_answer(session.sql(f"select {udf_name}()"), [Row("0.4.2")])
+    assert _probe(session, probe_udf(), "skfuzzy") == "0.4.2"
 
 
 @pytest.mark.udf
@@ -931,7 +875,7 @@ def test_add_requirements_unsupported_with_cache_path_works_even_if_caching_fail
     reason="Subprocess calls are not allowed within stored procedures.",
 )
 def test_add_requirements_unsupported_with_cache_path(
-    session, resources_path, temporary_stage
+    session, test_files, request, probe_udf
 ):
     """
     Assert that if a cache_path is mentioned, the zipped packages file and a metadata file are present at this
@@ -941,59 +885,61 @@ def test_add_requirements_unsupported_with_cache_path(
 
     Finally, assert that adding a new unsupported package results in a new environment signature and zip file (i.e.
     two environments should be present on the stage).
+
+    With SNOWPARK_TEST_REUSE_PERSIST_STAGE=1, cache_path is a stage kept across test runs and the steps that populate
+    it are skipped once it already holds the environment.
     """
-    test_files = TestFiles(resources_path)
+    cache_stage = request.getfixturevalue(
+        "persistent_ci_stage" if REUSE_PERSIST_STAGE else "temporary_stage"
+    )
     session.custom_package_usage_config = {
         "enabled": True,
-        "cache_path": temporary_stage,
+        "cache_path": cache_stage,
     }
 
-    # Prove that patching _upload_unsupported_packages leads to failure
-    with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
-        with patch(
-            "snowflake.snowpark.session.Session._upload_unsupported_packages",
-            side_effect=Exception("Intentionally raised an exception to test"),
-        ):
-            with pytest.raises(
-                Exception, match="Intentionally raised an exception to test"
-            ):
-                session.add_requirements(test_files.test_unsupported_requirements_file)
-
-    session.clear_imports()
-    session.clear_packages()
-
-    with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
-        session.add_requirements(test_files.test_unsupported_requirements_file)
-        # Once scikit-fuzzy is supported, this test will break; change the test to a different unsupported module
-
     environment_hash = get_signature(["scikit-fuzzy==0.4.2"])
     zip_file = f"{IMPLICIT_ZIP_FILE_NAME}_{environment_hash}.zip"
     metadata_file = f"{ENVIRONMENT_METADATA_FILE_NAME}.txt"
-    stage_files = session._list_files_in_stage(temporary_stage)
 
-    assert f"{zip_file}.gz" in stage_files
-    assert metadata_file in stage_files
+    stage_files = session._list_files_in_stage(cache_stage)
+    if not {f"{zip_file}.gz", metadata_file} <= stage_files:
+        # Prove that patching _upload_unsupported_packages leads to failure
+        with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
+            with patch(
+                "snowflake.snowpark.session.Session._upload_unsupported_packages",
+                side_effect=Exception("Intentionally raised an exception to test"),
+            ):
+                with pytest.raises(
+                    Exception, match="Intentionally raised an exception to test"
+                ):
+                    session.add_requirements(
+                        test_files.test_unsupported_requirements_file
+                    )
 
-    session_imports = session.get_imports()
-    assert len(session_imports) == 1
-    assert f"{temporary_stage}/{zip_file}" in session_imports[0]
-    package_set = set(session.get_packages().keys())
-    assert "numpy" in package_set
-    assert "scipy" in package_set
-    assert "matplotlib" in package_set
-    assert "pyyaml" in package_set
+        session.clear_imports()
+        session.clear_packages()
 
-    def import_scikit_fuzzy() -> str:
-        import skfuzzy as fuzz
+        with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
+            session.add_requirements(test_files.test_unsupported_requirements_file)
+            # Once scikit-fuzzy is supported, this test will break; change the test to a different unsupported module
 
-        return f"{fuzz.__version__}"
+        stage_files = session._list_files_in_stage(cache_stage)
+        assert f"{zip_file}.gz" in stage_files
+        assert metadata_file in stage_files
 
-    udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
-    session.udf.register(import_scikit_fuzzy, name=udf_name)
-    Utils.check_answer(session.sql(f"select {udf_name}()"), [Row("0.4.2")])
+        session_imports = session.get_imports()
+        assert len(session_imports) == 1
+        assert f"{cache_stage}/{zip_file}" in session_imports[0]
+        package_set = set(session.get_packages().keys())
+        assert "numpy" in package_set
+        assert "scipy" in package_set
+        assert "matplotlib" in package_set
+        assert "pyyaml" in package_set
 
-    session.clear_packages()
-    session.clear_imports()
+        assert _probe(session, probe_udf(), "skfuzzy") == "0.4.2"
+
+        session.clear_packages()
+        session.clear_imports()
 
     # Use existing zip file to run the same function again
     with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
@@ -1004,22 +950,16 @@ def test_add_requirements_unsupported_with_cache_path(
             # This should not raise error because we no long call _upload_unsupported_packages (we load it from env)
             session.add_requirements(test_files.test_unsupported_requirements_file)
 
-    stage_files = session._list_files_in_stage(temporary_stage)
-    assert f"{zip_file}.gz" in stage_files
-    assert metadata_file in stage_files
-
     session_imports = session.get_imports()
     assert len(session_imports) == 1
-    assert f"{temporary_stage}/{zip_file}" in session_imports[0]
+    assert f"{cache_stage}/{zip_file}" in session_imports[0]
     package_set = set(session.get_packages().keys())
     assert "numpy" in package_set
     assert "scipy" in package_set
     assert "matplotlib" in package_set
     assert "pyyaml" in package_set
 
-    udf_name = Utils.random_name_for_temp_object(TempObjectType.FUNCTION)
-    session.udf.register(import_scikit_fuzzy, name=udf_name)
-    Utils.check_answer(session.sql(f"select {udf_name}()"), [Row("0.4.2")])
+    assert _probe(session, probe_udf(), "skfuzzy") == "0.4.2"
 
     # Add a second environment
     with patch.object(session, "_is_anaconda_terms_acknowledged", lambda: True):
@@ -1034,8 +974,8 @@ def test_add_requirements_unsupported_with_cache_path(
     assert "scikit-learn" in package_set
     assert "six" in package_set
 
-    # Assert that metadata contains two environment signatures
-    metadata_path = f"{temporary_stage}/{metadata_file}"
+    # Assert that metadata contains both environment signatures
+    metadata_path = f"{cache_stage}/{metadata_file}"
     metadata = {
         row[0]: row[1].split("|") if row[1] else []
         for row in (
@@ -1044,9 +984,11 @@ def test_add_requirements_unsupported_with_cache_path(
             )._internal_collect_with_tag()
         )
     }
-    assert len(metadata) == 2
+    assert environment_hash in metadata
+    assert get_signature(["sktime==0.25.0"]) in metadata
 
 
+@pytest.mark.xdist_group(name="packaging_nopip")
 def test_get_available_versions_for_packages(session):
     """
     Assert that the utility function get_available_versions_for_packages() returns a list of versions available in Snowflake,
@@ -1064,6 +1006,7 @@ def test_get_available_versions_for_packages(session):
         assert len(returned[key]) > 0
 
 
+@pytest.mark.xdist_group(name="packaging_nopip")
 @pytest.mark.localtest
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
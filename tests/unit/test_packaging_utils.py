@@ -2,23 +2,29 @@
 # Copyright (c) 2012-2024 Snowflake Computing Inc. All rights reserved.
 #
 
+import importlib.metadata
 import os
+import platform
+import time
 import zipfile
 from subprocess import TimeoutExpired
 from unittest.mock import patch
 
-import pkg_resources
 import pytest
-from pkg_resources import Requirement
+from packaging.requirements import Requirement
 
+from snowflake.snowpark._internal import packaging_utils
 from snowflake.snowpark._internal.packaging_utils import (
     SNOWPARK_PACKAGE_NAME,
+    _get_local_snowpark_version,
     add_snowpark_package,
     detect_native_dependencies,
     get_package_name_from_metadata,
+    get_requirement_version,
     get_signature,
     identify_supported_packages,
     map_python_packages_to_files_and_folders,
+    parse_conda_environment_yaml_file,
     pip_install_packages_to_target_folder,
     zip_directory_contents,
 )
@@ -82,8 +88,8 @@ def test_get_downloaded_packages(temp_directory):
 def test_get_downloaded_packages_malformed(temp_directory):
     """
     Assert that when packages are malformed, no errors are raised; instead, we proceed with processing non-malformed
-    packages (in this case 'package03'). 'package01' is missing a RECORD file while 'package02' has a malformed
-    METADATA file.
+    packages (in this case 'package03'). 'package01' is missing a RECORD file, 'package02' has a malformed
+    METADATA file and 'package04' is missing a METADATA file.
     """
     package_names = ["package01", "package02", "package03"]
     for package in package_names:
@@ -117,6 +123,13 @@ def test_get_downloaded_packages_malformed(temp_directory):
         with open(os.path.join(folder1_path, "METADATA"), "w") as f:
             f.write(f"Name: {package}")
 
+    # A dist-info folder without a METADATA file is skipped as well
+    os.makedirs(os.path.join(temp_directory, "package04-0.1.dist-info"))
+    with open(
+        os.path.join(temp_directory, "package04-0.1.dist-info", "RECORD"), "w"
+    ) as f:
+        f.write(f"{package_names[2]}/file.py,sha256=hash,341243\n")
+
     downloaded_packages = map_python_packages_to_files_and_folders(str(temp_directory))
     print(downloaded_packages)
     assert {key.name for key in downloaded_packages.keys()} == {
@@ -130,6 +143,27 @@ def test_get_downloaded_packages_malformed(temp_directory):
         }
 
 
+def test_get_downloaded_packages_ignores_entries_outside_directory(tmpdir_factory):
+    """
+    Assert that RECORD entries pointing outside the target folder are ignored, even if the files exist.
+    """
+    base_directory = tmpdir_factory.mktemp("base_dir")
+    target = os.path.join(base_directory, "packages")
+    dist_info_folder_path = os.path.join(target, "package1-0.1.dist-info")
+    os.makedirs(dist_info_folder_path)
+    os.makedirs(os.path.join(target, "package1"))
+    with open(os.path.join(base_directory, "outside.py"), "w") as f:
+        f.write("content")
+    with open(os.path.join(dist_info_folder_path, "METADATA"), "w") as f:
+        f.write("Name: package1")
+    with open(os.path.join(dist_info_folder_path, "RECORD"), "w") as f:
+        f.write("package1/file.py,sha256=hash,341243\n")
+        f.write("../outside.py,sha256=hash,341243\n")
+
+    downloaded_packages = map_python_packages_to_files_and_folders(target)
+    assert downloaded_packages == {Requirement("package1"): ["package1"]}
+
+
 @pytest.mark.skipif(
     IS_IN_STORED_PROC,
     reason="Subprocess calls are not allowed within stored procedures.",
@@ -180,6 +214,72 @@ def test_get_package_name_from_metadata(temp_directory):
     assert package_name == "my_package==1.0.0"
 
 
+def test_get_package_name_from_metadata_headers(temp_directory):
+    metadata_file_path = temp_directory.join("METADATA")
+    metadata_file_path.write(
+        "Metadata-Version: 2.1\nVersion: 2.0.0\nName: My_Package\n\nDescription\n"
+    )
+    assert get_package_name_from_metadata(str(metadata_file_path)) == (
+        "my_package==2.0.0"
+    )
+
+    metadata_file_path.write("Metadata-Version: 2.1\nName: my_package\n")
+    assert get_package_name_from_metadata(str(metadata_file_path)) == "my_package"
+
+    metadata_file_path.write("Metadata-Version: 2.1\nVersion: 1.0.0\n")
+    assert get_package_name_from_metadata(str(metadata_file_path)) is None
+
+    # Headers after the first read, and a line cut by the first read, are found in the full file
+    padding = "Summary: " + "a" * 4036 + "\n"
+    metadata_file_path.write(
+        f"Metadata-Version: 2.1\nName: my_package\n{padding}Version: 1.23.4\n"
+    )
+    assert get_package_name_from_metadata(str(metadata_file_path)) == (
+        "my_package==1.23.4"
+    )
+
+    metadata_file_path.write_binary(b"Name: my_package\r\nVersion: 1.0.0\r\n")
+    assert get_package_name_from_metadata(str(metadata_file_path)) == (
+        "my_package==1.0.0"
+    )
+
+
+def test_parse_conda_environment_yaml_file_bad_yaml(temp_directory):
+    yaml_file_path = temp_directory.join("environment.yaml")
+    yaml_file_path.write(
+        """
+    some_key: some_value:
+        - list_item1
+        - list_item2
+    """
+    )
+    with pytest.raises(
+        ValueError,
+        match="Error while parsing YAML file, it may not be a valid Conda environment file",
+    ):
+        parse_conda_environment_yaml_file(str(yaml_file_path))
+
+
+def test_parse_conda_environment_yaml_file_ranged_requirements(temp_directory):
+    yaml_file_path = temp_directory.join("environment.yaml")
+    yaml_file_path.write(
+        """
+    name: my_environment  # Name of the environment
+    channels:  # List of Conda channels to use for package installation
+      - conda-forge
+      - defaults
+    dependencies:  # List of packages and versions to include in the environment
+      - python=3.9  # Python version
+      - numpy<=1.24.3
+    """
+    )
+    with pytest.raises(
+        ValueError,
+        match="Conda dependency with ranges 'numpy<=1.24.3' is not supported",
+    ):
+        parse_conda_environment_yaml_file(str(yaml_file_path))
+
+
 def test_zip_directory_contents(temp_directory):
     """
     Asserts that zip_directory_contents()  zips and stores the correct files.
@@ -211,15 +311,160 @@ def test_zip_directory_contents(temp_directory):
         assert f.read() == "zero_content"
 
 
+def test_zip_directory_contents_stores_compressed_files(temp_directory):
+    """
+    Asserts that zip_directory_contents() does not deflate files that are already compressed.
+    """
+    folder_path = os.path.join(temp_directory, "to_be_zipped_folder")
+    os.makedirs(folder_path)
+    with open(os.path.join(folder_path, "file.txt"), "w") as f:
+        f.write("content")
+    with open(os.path.join(folder_path, "file.whl"), "w") as f:
+        f.write("content")
+
+    zip_folder_path = os.path.join(temp_directory, "zip_folder.zip")
+    zip_directory_contents(folder_path, zip_folder_path)
+
+    with zipfile.ZipFile(zip_folder_path, "r") as zip_ref:
+        assert zip_ref.getinfo("file.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert zip_ref.getinfo("file.whl").compress_type == zipfile.ZIP_STORED
+        assert zip_ref.read("file.whl") == b"content"
+        assert zip_ref.testzip() is None
+
+
+def test_zip_directory_contents_with_old_timestamps(temp_directory):
+    """
+    Asserts that zip_directory_contents() accepts files dated before 1980, which zip files cannot represent.
+    """
+    folder_path = os.path.join(temp_directory, "to_be_zipped_folder")
+    os.makedirs(folder_path)
+    for file_name in ["file.txt", "file.whl"]:
+        file_path = os.path.join(folder_path, file_name)
+        with open(file_path, "w") as f:
+            f.write("content")
+        os.utime(file_path, (0, 0))
+
+    zip_folder_path = os.path.join(temp_directory, "zip_folder.zip")
+    zip_directory_contents(folder_path, zip_folder_path)
+
+    with zipfile.ZipFile(zip_folder_path, "r") as zip_ref:
+        for file_name in ["file.txt", "file.whl"]:
+            assert zip_ref.getinfo(file_name).date_time[0] == 1980
+            assert zip_ref.read(file_name) == b"content"
+
+
+def test_zip_directory_contents_mixed_members(temp_directory):
+    """
+    Asserts that an archive mixing directories, stored files and files deflated on the thread pool is valid.
+    """
+    folder_path = os.path.join(temp_directory, "to_be_zipped_folder")
+    os.makedirs(os.path.join(folder_path, "package", "nested"))
+    contents = {
+        "package/__init__.py": b"import os\n" * 100,
+        "package/nested/module.py": b"VALUE = 1\n",
+        "package/nested/image.png": os.urandom(1024),
+        "package/data.gz": os.urandom(1024),
+    }
+    for name, content in contents.items():
+        with open(os.path.join(folder_path, *name.split("/")), "wb") as f:
+            f.write(content)
+
+    zip_folder_path = os.path.join(temp_directory, "zip_folder.zip")
+    zip_directory_contents(folder_path, zip_folder_path)
+
+    with zipfile.ZipFile(zip_folder_path, "r") as zip_ref:
+        assert zip_ref.testzip() is None
+        assert zip_ref.getinfo("package/").is_dir()
+        assert zip_ref.getinfo("package/nested/").is_dir()
+        for name, content in contents.items():
+            assert zip_ref.read(name) == content
+        assert (
+            zip_ref.getinfo("package/__init__.py").compress_type == zipfile.ZIP_DEFLATED
+        )
+        assert zip_ref.getinfo("package/data.gz").compress_type == zipfile.ZIP_STORED
+
+
+def test_zip_directory_contents_round_trips_large_files(temp_directory):
+    """
+    Asserts that files spanning several write chunks survive a round trip through every way zip_directory_contents()
+    writes members: streamed because they are too large for the thread pool, stored as already compressed, and
+    deflated on the thread pool while the in-flight buffer is full.
+    """
+    folder_path = os.path.join(temp_directory, "to_be_zipped_folder")
+    os.makedirs(folder_path)
+    contents = {
+        "large.so": os.urandom(3 << 20),
+        "large.whl": os.urandom(3 << 20),
+    }
+    for i in range(8):
+        contents[f"small_{i}.py"] = os.urandom(256 << 10)
+    for name, content in contents.items():
+        with open(os.path.join(folder_path, name), "wb") as f:
+            f.write(content)
+
+    zip_folder_path = os.path.join(temp_directory, "zip_folder.zip")
+    with patch(
+        "snowflake.snowpark._internal.packaging_utils._PARALLEL_DEFLATE_MAX_FILE_SIZE",
+        1 << 20,
+    ), patch(
+        "snowflake.snowpark._internal.packaging_utils._PARALLEL_DEFLATE_BUFFER_SIZE",
+        512 << 10,
+    ):
+        zip_directory_contents(folder_path, zip_folder_path)
+
+    with zipfile.ZipFile(zip_folder_path, "r") as zip_ref:
+        assert zip_ref.testzip() is None
+        assert zip_ref.getinfo("large.so").compress_type == zipfile.ZIP_DEFLATED
+        assert zip_ref.getinfo("large.whl").compress_type == zipfile.ZIP_STORED
+        assert len(zip_ref.namelist()) == len(contents)
+        for name, content in contents.items():
+            assert zip_ref.read(name) == content
+
+
+def test_zip_directory_contents_is_reproducible(temp_directory):
+    """
+    Asserts that files deflated on the thread pool are written in the order they were found, even when later files
+    finish compressing first, so the same directory always gives the same zip file.
+    """
+    folder_path = os.path.join(temp_directory, "to_be_zipped_folder")
+    os.makedirs(folder_path)
+    for i in range(8):
+        with open(os.path.join(folder_path, f"file_{i}.py"), "w") as f:
+            f.write(f"content {i}")
+    walk_order = next(os.walk(folder_path))[2]
+
+    deflate_file = packaging_utils._deflate_file
+
+    def slow_deflate_file(path):
+        # The earlier a file was found, the longer it takes to compress
+        time.sleep(0.05 * (len(walk_order) - walk_order.index(os.path.basename(path))))
+        return deflate_file(path)
+
+    # Files next to the target directory are zipped too, so keep the zip files away from it
+    output_folder_path = os.path.join(temp_directory, "zip_folders")
+    os.makedirs(output_folder_path)
+    zip_folder_paths = [
+        os.path.join(output_folder_path, f"zip_folder_{i}.zip") for i in range(2)
+    ]
+    with patch.object(packaging_utils, "_deflate_file", slow_deflate_file):
+        for zip_folder_path in zip_folder_paths:
+            zip_directory_contents(folder_path, zip_folder_path)
+
+    with zipfile.ZipFile(zip_folder_paths[0], "r") as zip_ref:
+        assert zip_ref.namelist() == walk_order
+    with open(zip_folder_paths[0], "rb") as f0, open(zip_folder_paths[1], "rb") as f1:
+        assert f0.read() == f1.read()
+
+
 def test_identify_supported_packages_vanilla():
     """
     Assert that the most straightforward usage of identify_supported_packages() works
     """
     packages = [
-        Requirement.parse("package1==1.0.0"),
-        Requirement.parse("package2==2.0.0"),
-        Requirement.parse("package3"),
-        Requirement.parse("package4==2.1.2"),
+        Requirement("package1==1.0.0"),
+        Requirement("package2==2.0.0"),
+        Requirement("package3"),
+        Requirement("package4==2.1.2"),
     ]
     valid_packages = {
         "package1": ["1.0.0", "1.1.0"],
@@ -238,7 +483,7 @@ def test_identify_supported_packages_vanilla():
     assert len(dropped_deps) == 1
     assert packages[3] in dropped_deps
     assert len(new_deps) == 1
-    assert Requirement.parse("package4") in new_deps
+    assert Requirement("package4") in new_deps
 
 
 def test_identify_supported_packages_all_cases():
@@ -250,7 +495,7 @@ def test_identify_supported_packages_all_cases():
 
     # Case 1: All packages supported
     native_packages = {"pandas"}
-    packages = [Requirement.parse("numpy==1.2"), Requirement.parse("pandas")]
+    packages = [Requirement("numpy==1.2"), Requirement("pandas")]
     supported, dropped, new = identify_supported_packages(
         packages, valid_packages, native_packages, {}
     )
@@ -261,29 +506,29 @@ def test_identify_supported_packages_all_cases():
 
     # Case 2: One non-native package, version not supported
     native_packages = {"pandas"}
-    packages = [Requirement.parse("numpy==10.0"), Requirement.parse("pandas")]
+    packages = [Requirement("numpy==10.0"), Requirement("pandas")]
     supported, dropped, new = identify_supported_packages(
         packages, valid_packages, native_packages, {}
     )
-    assert supported == [Requirement.parse("pandas")]
+    assert supported == [Requirement("pandas")]
     assert dropped == []
     assert new == []
     assert native_packages == set()
 
     # Case 3: Native package version not available, should switch to latest available version
     native_packages = {"numpy", "pandas"}
-    packages = [Requirement.parse("numpy==10.0"), Requirement.parse("pandas")]
+    packages = [Requirement("numpy==10.0"), Requirement("pandas")]
     supported, dropped, new = identify_supported_packages(
         packages, valid_packages, native_packages, {}
     )
-    assert supported == [Requirement.parse("pandas")]
-    assert dropped == [Requirement.parse("numpy==10.0")]
-    assert new == [Requirement.parse("numpy")]
+    assert supported == [Requirement("pandas")]
+    assert dropped == [Requirement("numpy==10.0")]
+    assert new == [Requirement("numpy")]
     assert native_packages == set()
 
     # Case 4: Package not in valid_packages and not a native package either
     native_packages = {"numpy", "pandas"}
-    packages = [Requirement.parse("somepackage")]
+    packages = [Requirement("somepackage")]
     supported, dropped, new = identify_supported_packages(
         packages, valid_packages, native_packages, {}
     )
@@ -329,51 +574,100 @@ def test_no_pip(monkeypatch, temp_directory):
         pip_install_packages_to_target_folder(packages, target_folder)
 
 
-def test_detect_native_dependencies():
-    target = "/path/to/target"
+def test_detect_native_dependencies(temp_directory):
+    target = str(temp_directory)
     downloaded_packages_dict = {
-        Requirement.parse("numpy"): ["numpy"],
-        Requirement.parse("pandas"): ["pandas"],
+        Requirement("numpy"): ["numpy"],
+        Requirement("pandas"): ["pandas"],
     }
+    native_extension = ".dll" if platform.system() == "Windows" else ".so"
+    for folder in ["numpy", "pandas", "unknown"]:
+        os.makedirs(os.path.join(target, folder))
 
-    # Mock the glob.glob function to return specific paths
-    with patch("glob.glob") as mock_glob:
-        # Case 1: No .so files found
-        mock_glob.return_value = []
-        result = detect_native_dependencies(target, downloaded_packages_dict)
-        assert result == set()
+    # Case 1: No native files found
+    with open(os.path.join(target, "numpy", "file.py"), "w") as f:
+        f.write("content")
+    result = detect_native_dependencies(target, downloaded_packages_dict)
+    assert result == set()
 
-        # Case 2: .so files found, associated with a package
-        mock_glob.return_value = ["/path/to/target/numpy/file.so"]
-        result = detect_native_dependencies(target, downloaded_packages_dict)
-        assert result == {"numpy"}
+    # Case 2: Native files found, associated with a package
+    with open(os.path.join(target, "numpy", f"file{native_extension}"), "w") as f:
+        f.write("content")
+    result = detect_native_dependencies(target, downloaded_packages_dict)
+    assert result == {"numpy"}
 
-        # Case 3: .so files found, not associated with a package
-        mock_glob.return_value = ["/path/to/target/unknown/file.so"]
-        result = detect_native_dependencies(target, downloaded_packages_dict)
-        assert result == set()
+    # Case 3: Native files found, not associated with a package
+    os.remove(os.path.join(target, "numpy", f"file{native_extension}"))
+    with open(os.path.join(target, "unknown", f"file{native_extension}"), "w") as f:
+        f.write("content")
+    result = detect_native_dependencies(target, downloaded_packages_dict)
+    assert result == set()
+
+    # Case 4: Native files found in a nested folder or at the base directory, associated with a package
+    os.makedirs(os.path.join(target, "pandas", "core"))
+    with open(
+        os.path.join(target, "pandas", "core", f"file{native_extension}"), "w"
+    ) as f:
+        f.write("content")
+    with open(os.path.join(target, f"six{native_extension}"), "w") as f:
+        f.write("content")
+    downloaded_packages_dict[Requirement("pandas")].append("pandas/core")
+    downloaded_packages_dict[Requirement("six")] = [f"six{native_extension}"]
+    result = detect_native_dependencies(target, downloaded_packages_dict)
+    assert result == {"pandas", "six"}
+
+    # Case 5: No downloaded packages
+    result = detect_native_dependencies(target, {})
+    assert result == set()
+
+    # Case 6: Packages sharing a top level folder are detected independently
+    os.makedirs(os.path.join(target, "shared", "sub"))
+    for folder in ["shared", os.path.join("shared", "sub")]:
+        with open(os.path.join(target, folder, f"file{native_extension}"), "w") as f:
+            f.write("content")
+    shared_packages_dict = {
+        Requirement("package1"): ["shared"],
+        Requirement("package2"): ["shared/sub"],
+    }
+    result = detect_native_dependencies(target, shared_packages_dict)
+    assert result == {"package1", "package2"}
 
 
 def test_add_snowpark_package():
     version = "1.3.0"
     valid_packages = {SNOWPARK_PACKAGE_NAME: [version]}
     result_dict = {}
-    with patch("pkg_resources.get_distribution") as mock_get_distribution:
-        mock_get_distribution.return_value.version = version
+    _get_local_snowpark_version.cache_clear()
+    with patch("importlib.metadata.version") as mock_version:
+        mock_version.return_value = version
         add_snowpark_package(result_dict, valid_packages)
         assert result_dict == {SNOWPARK_PACKAGE_NAME: f"{SNOWPARK_PACKAGE_NAME}==1.3.0"}
 
+        # The local version is looked up only once
+        result_dict = {}
+        add_snowpark_package(result_dict, valid_packages)
+        assert result_dict == {SNOWPARK_PACKAGE_NAME: f"{SNOWPARK_PACKAGE_NAME}==1.3.0"}
+        mock_version.assert_called_once()
+    _get_local_snowpark_version.cache_clear()
+
 
 def test_add_snowpark_package_if_missing():
     version = "1.3.0"
     valid_packages = {SNOWPARK_PACKAGE_NAME: [version]}
     result_dict = {}
-    with patch("pkg_resources.get_distribution") as mock_get_distribution:
-        mock_get_distribution.side_effect = pkg_resources.DistributionNotFound(
+    _get_local_snowpark_version.cache_clear()
+    with patch("importlib.metadata.version") as mock_version:
+        mock_version.side_effect = importlib.metadata.PackageNotFoundError(
             "Package not found"
         )
         add_snowpark_package(result_dict, valid_packages)  # Should not raise any error
         assert result_dict == {SNOWPARK_PACKAGE_NAME: SNOWPARK_PACKAGE_NAME}
+    _get_local_snowpark_version.cache_clear()
+
+
+def test_get_requirement_version():
+    assert get_requirement_version(Requirement("numpy==1.24.3")) == "1.24.3"
+    assert get_requirement_version(Requirement("numpy")) is None
 
 
 def test_get_signature():